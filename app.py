@@ -1,9 +1,11 @@
 import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox, filedialog
+from tkinter import ttk, messagebox, filedialog
 from tkinter.constants import ANCHOR
 from collections import defaultdict
 from datetime import datetime
 import subprocess
+import tempfile
+import concurrent.futures
 import threading
 import json
 import os
@@ -11,6 +13,11 @@ import queue
 
 import webbrowser
 
+from app.utils.json_utils import save_json_atomic, dump_json_bytes, write_bytes_atomic
+
+# ログ表示エリアに保持する最大行数（長時間の実行でも表示が重くならないよう、古い行から削除する）
+MAX_LOG_LINES = 5000
+
 
 class ScraperApp:
     def __init__(self, master):
@@ -93,8 +100,13 @@ class ScraperApp:
         self.status_label.pack(side=tk.RIGHT, padx=5)
 
         # ログ表示用テキストエリア
-        self.log_text = scrolledtext.ScrolledText(self.log_frame, wrap=tk.WORD, height=8)
-        self.log_text.pack(fill=tk.BOTH, expand=True)
+        # スクロールバーの更新はアイドル時にまとめて行うため、ScrolledTextではなくTextとScrollbarを個別に配置する
+        self.pending_log_yscroll = None
+        self.log_text = tk.Text(self.log_frame, wrap=tk.WORD, height=8)
+        self.log_scrollbar = ttk.Scrollbar(self.log_frame, orient=tk.VERTICAL, command=self.log_text.yview)
+        self.log_text.configure(yscrollcommand=self.on_log_yscroll)
+        self.log_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.log_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
         # フィルター用チェックボックス
         self.category_vars = {}
@@ -120,12 +132,14 @@ class ScraperApp:
         # サブプロセスとキューの初期化
         self.process = None
         self.log_queue = queue.Queue()
+        # DBへの書き込みで画面が止まらないよう、1つのワーカースレッドで順番に書き込む
+        self.db_writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
 
         # 初期状態でログ表示を更新
         self.toggle_log_display()
 
-        # 定期的なUI更新を開始
-        self.master.after(100, self.process_log_queue)
+        # ワーカースレッドからの通知でキューを処理する（定期的なポーリングは行わない）
+        self.master.bind("<<LogReady>>", self.process_log_queue)
         
         # アプリケーション起動時にデバッグ用Chromeを起動する
         self.launch_debug_chrome()
@@ -140,6 +154,18 @@ class ScraperApp:
         else:
             self.log_frame.pack_forget()
 
+    def on_log_yscroll(self, first, last):
+        """ログ表示エリアの表示範囲の変化を受け取り、スクロールバーの更新をアイドル時の1回にまとめる"""
+        if self.pending_log_yscroll is None:
+            self.master.after_idle(self.update_log_scrollbar)
+        self.pending_log_yscroll = (first, last)
+
+    def update_log_scrollbar(self):
+        """最後に受け取った表示範囲でスクロールバーを更新する"""
+        first, last = self.pending_log_yscroll
+        self.pending_log_yscroll = None
+        self.log_scrollbar.set(first, last)
+
     def start_scraping_thread(self):
         """スクレイピング処理を別スレッドで開始する"""
         self.run_button.config(state=tk.DISABLED)
@@ -168,25 +194,37 @@ class ScraperApp:
             # サブプロセスの標準入出力エンコーディングをUTF-8に強制
             env = os.environ.copy()
             env["PYTHONIOENCODING"] = "utf-8"
+            # GUIから起動したことをスクリプトに伝え、テーブルで表示する内容のログ出力を省略させる
+            env["GUI_MODE"] = "1"
 
             self.process = subprocess.Popen(
                 command_args,
                 cwd=self.project_root, # モジュール実行のためカレントディレクトリを指定
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
-                text=True,
-                encoding='utf-8',
-                errors='ignore',
                 startupinfo=startupinfo,
                 env=env
             )
             # デッドロックを避けるため、出力読み取りとwaitを分離
-            for line in iter(self.process.stdout.readline, ''):
-                self.log_queue.put(line)
+            # 1行ずつreadlineするのではなく、パイプに届いた分をまとめて読み取ってから行に分割する
+            fd = self.process.stdout.fileno()
+            buffer = b""
+            while True:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    break
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                if lines:
+                    # UTF-8の複数バイト文字に改行コードのバイトは含まれないため、行単位でデコードできる
+                    # 1回の読み取りで得た行はまとめて1つの項目としてキューに入れ、ロックと画面への通知を1回で済ませる
+                    self.put_log("".join(line.rstrip(b"\r").decode('utf-8', errors='ignore') + "\n" for line in lines))
+            if buffer:
+                self.put_log(buffer.decode('utf-8', errors='ignore'))
         except FileNotFoundError:
-            self.log_queue.put("エラー: 'python'コマンドが見つかりません。PythonがPATHに設定されているか確認してください。")
+            self.put_log("エラー: 'python'コマンドが見つかりません。PythonがPATHに設定されているか確認してください。")
         except Exception as e:
-            self.log_queue.put(f"スクリプト実行中に予期せぬエラーが発生しました: {e}")
+            self.put_log(f"スクリプト実行中に予期せぬエラーが発生しました: {e}")
         finally:
             # 処理完了後にGUIに通知
             if self.process:
@@ -194,28 +232,58 @@ class ScraperApp:
             
             # 実行されたモジュール名からタスクタイプを判別
             if 'app.tasks.analysis' in " ".join(command_args):
-                self.log_queue.put(("PROCESS_FINISHED", "analyze"))
+                self.put_log(("PROCESS_FINISHED", "analyze"))
             elif 'app.tasks.posting' in " ".join(command_args):
-                self.log_queue.put(("PROCESS_FINISHED", "post"))
+                self.put_log(("PROCESS_FINISHED", "post"))
 
-    def process_log_queue(self):
-        """キューからログを取得してUIに表示する"""
+    def put_log(self, item):
+        """ログ（または完了通知）をキューに入れ、画面スレッドに処理を依頼する。ワーカースレッドから呼び出す"""
+        self.log_queue.put(item)
+        try:
+            # event_generate はスレッド対応のTclであれば他スレッドから呼び出せる
+            self.master.event_generate("<<LogReady>>", when="tail")
+        except (RuntimeError, tk.TclError):
+            # メインループ開始前や終了後は通知できないが、キューに残った項目は次の通知でまとめて処理される
+            pass
+
+    def process_log_queue(self, event=None):
+        """キューに溜まったログをすべて取得してUIに表示する"""
+        # ログは1行ずつではなく、まとめて1回のinsertで追加する
+        pending_lines = []
+        get_nowait = self.log_queue.get_nowait
         try:
             while True:
-                item = self.log_queue.get_nowait()
+                item = get_nowait()
                 if isinstance(item, tuple) and item[0] == "PROCESS_FINISHED":
+                    # 完了処理の前に、それまでのログを表示しておく
+                    self.append_log("".join(pending_lines))
+                    pending_lines = []
                     task_type = item[1]
                     if task_type == "analyze":
                         self.on_scraping_complete()
                     else: # postタスクなど、他のタスク完了時
                         self.on_action_complete()
                 elif isinstance(item, str):
-                    self.log_text.insert(tk.END, item)
-                    self.log_text.see(tk.END)
+                    pending_lines.append(item)
         except queue.Empty:
             pass
-        finally:
-            self.master.after(100, self.process_log_queue)
+        self.append_log("".join(pending_lines))
+
+    def append_log(self, text: str):
+        """ログ表示エリアの末尾にテキストを追加する"""
+        if not text:
+            return
+        # 追加前に末尾付近を表示していた場合のみ自動でスクロールし、過去のログを読んでいる間は位置を保つ
+        log_text = self.log_text
+        follow_tail = log_text.yview()[1] >= 0.98
+        log_text.insert(tk.END, text)
+        # 上限を超えた分の古い行を1回の操作でまとめて削除する
+        line_count = int(log_text.index('end-1c').split('.')[0])
+        overflow = line_count - MAX_LOG_LINES
+        if overflow > 0:
+            log_text.delete('1.0', f'{overflow + 1}.0')
+        if follow_tail:
+            log_text.see(tk.END)
 
     def on_scraping_complete(self):
         """分析スクレイピング完了時の処理"""
@@ -257,9 +325,8 @@ class ScraperApp:
 
     def load_json_from_file(self):
         """ファイルダイアログを開き、JSONファイルを読み込んでテーブルに表示する"""
-        project_root = os.path.dirname(os.path.abspath(__file__))
         file_path = filedialog.askopenfilename(
-            initialdir=project_root,
+            initialdir=self.project_root,
             title="JSONファイルを選択",
             filetypes=(("JSON files", "*.json"), ("All files", "*.*"))
         )
@@ -289,7 +356,7 @@ class ScraperApp:
             return
 
         file_path = filedialog.asksaveasfilename(
-            initialdir=os.path.dirname(os.path.abspath(__file__)),
+            initialdir=self.project_root,
             title="名前を付けて保存",
             filetypes=(("JSON files", "*.json"), ("All files", "*.*")),
             defaultextension=".json"
@@ -299,8 +366,7 @@ class ScraperApp:
             return
 
         try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(self.current_results, f, ensure_ascii=False, indent=4)
+            save_json_atomic(file_path, self.current_results)
             messagebox.showinfo("成功", f"結果を {os.path.basename(file_path)} に保存しました。")
         except Exception as e:
             messagebox.showerror("保存エラー", f"ファイルのエクスポート中にエラーが発生しました:\n{e}")
@@ -452,18 +518,23 @@ class ScraperApp:
         selected_categories = {cat for cat, var in self.category_vars.items() if var.get()}
         show_posted = self.show_posted_var.get()
 
+        # 表示する行の値を先にすべて組み立ててから、まとめてTreeviewに追加する
+        checked_items = self.checked_items
+        category_icons = self.category_icons
+        rows = []
         for i, item in enumerate(self.current_results):
             is_posted = item.get('post_status') == '投稿済'
             if is_posted and not show_posted: # 「投稿済を表示」がオフの時は、投稿済アイテムをスキップ
                 continue # 投稿済で、表示する設定でなければスキップ
 
             if item.get('category') in selected_categories:
-                checked_char = "☑" if self.checked_items.get(str(i)) else "☐"
+                iid = str(i)
+                checked_char = "☑" if checked_items.get(iid) else "☐"
                 is_following_icon = "👤" if item.get('is_following', False) else ""
-                category_icon = self.category_icons.get(item.get('category', ''), '❓')
+                category_icon = category_icons.get(item.get('category', ''), '❓')
                 has_comment_icon = "💬" if item.get('comment_count', 0) > 0 else ""
                 user_name = item.get('name', '')
-                if item.get('post_status') == '投稿済':
+                if is_posted:
                     user_name = f"[済] {user_name}"
                 
                 # 日時フォーマットの変更
@@ -485,27 +556,33 @@ class ScraperApp:
                     formatted_timestamp
                 )
                 # 投稿ステータスに応じてタグを設定
-                tags = ()
-                if item.get('post_status') == '投稿済':
-                    tags = ('posted',)
-                self.tree.insert("", tk.END, iid=str(i), values=values, tags=tags)
+                tags = ('posted',) if is_posted else ()
+                rows.append((iid, values, tags))
+
+        insert = self.tree.insert
+        for iid, values, tags in rows:
+            insert("", tk.END, iid=iid, values=values, tags=tags)
 
     def on_tree_click(self, event):
         """Treeviewのクリックイベントを処理する（ヘッダーまたはセル）"""
-        region = self.tree.identify("region", event.x, event.y)
+        tree = self.tree
+        region = tree.identify("region", event.x, event.y)
 
         if region == "heading":
-            column_id = self.tree.identify_column(event.x)
+            column_id = tree.identify_column(event.x)
             # "selection"列（#1）のヘッダーがクリックされた場合
             if column_id == '#1':
                 self.toggle_all_checkboxes()
         
         elif region == "cell": # セルがクリックされた場合
-            column_id = self.tree.identify_column(event.x)
-            item_id = self.tree.identify_row(event.y)
+            column_id = tree.identify_column(event.x)
+            # "selection"列（#1）以外のセルでは行を特定する必要がない
+            if column_id != '#1':
+                return
+            item_id = tree.identify_row(event.y)
 
             # "selection"列（#1）のセルがクリックされた場合
-            if column_id == '#1' and item_id:
+            if item_id:
                 # 通常のクリックでチェックボックスをトグル
                 self.toggle_checkbox(item_id)
 
@@ -602,6 +679,8 @@ class ScraperApp:
         self.post_button.config(state=tk.DISABLED)
         self.status_label.config(text="投稿処理を実行中...")
 
+        post_targets = []
+        posted_ids = []
         for item_id in checked_ids:
             # current_resultsから元のデータを取得
             original_index = int(item_id)
@@ -615,11 +694,38 @@ class ScraperApp:
                 messagebox.showwarning("URLエラー", f"「{user_name}」さんのプロフィールURLが無効なため、処理をスキップします。")
                 continue
 
-            # 投稿処理を別スレッドで実行
-            # モジュールとして実行し、コメントも引数で渡す
-            command = ['python', '-u', '-m', 'app.tasks.posting', '--url', profile_url, '--comment', comment_text]
+            post_targets.append({'profile_page_url': profile_url, 'comment_text': comment_text})
+            posted_ids.append(item_id)
+
+        if not post_targets:
+            self.status_label.config(text="投稿対象がありません")
+            self.update_post_button_state()
+            return
+
+        # 投稿処理は1つのサブプロセスでまとめて実行し、ユーザーごとのプロセス起動とChromeへの再接続を避ける
+        # 実行中に次の投稿が始まっても対象が混ざらないよう、投稿のたびに別の対象ファイルを作成する（読み込み後にサブプロセスが削除する）
+        targets_path = None
+        try:
+            output_dir = os.path.join(self.project_root, "output")
+            os.makedirs(output_dir, exist_ok=True)
+            fd, targets_path = tempfile.mkstemp(dir=output_dir, prefix="post_targets_", suffix=".json")
+            with os.fdopen(fd, 'wb') as f:
+                f.write(dump_json_bytes(post_targets))
+            command = ['python', '-u', '-m', 'app.tasks.posting', '--targets-file', targets_path, '--delete-targets-file']
             post_thread = threading.Thread(target=self.run_script, args=(command,), daemon=True)
             post_thread.start()
+        except Exception as e:
+            if targets_path and os.path.exists(targets_path):
+                os.remove(targets_path)
+            messagebox.showerror("投稿エラー", f"投稿処理の開始に失敗しました:\n{e}")
+            self.status_label.config(text="投稿エラー")
+            self.update_post_button_state()
+            return
+
+        # 投稿処理を開始できた行だけを「投稿済」に更新する
+        for item_id in posted_ids:
+            original_index = int(item_id)
+            item_dict = self.current_results[original_index]
 
             # 投稿ステータスを「投稿済」に更新し、行の色を変更
             if self.tree.exists(item_id):
@@ -640,12 +746,21 @@ class ScraperApp:
         self.all_rows_checked = False
         self.tree.heading("selection", text="☐")
 
-        # 投稿ステータスの変更をDBに保存
+        # 投稿ステータスの変更をDBに保存（シリアライズは画面スレッドで行い、ファイル書き込みはバックグラウンドで行う）
         try:
-            with open(self.db_path, 'w', encoding='utf-8') as f:
-                json.dump(self.current_results, f, ensure_ascii=False, indent=4)
+            payload = dump_json_bytes(self.current_results)
         except Exception as e:
             messagebox.showerror("DB保存エラー", f"投稿ステータスの更新中にDBへの保存に失敗しました:\n{e}")
+            return
+        self.db_writer.submit(self.write_db_payload, payload)
+
+    def write_db_payload(self, payload: bytes):
+        """シリアライズ済みのDBデータをファイルに書き込む（DB書き込みスレッドで実行）"""
+        try:
+            write_bytes_atomic(self.db_path, payload)
+        except Exception as e:
+            # 画面スレッド以外からはウィジェットを操作できないため、ログキュー経由で通知する
+            self.put_log(f"DB保存エラー: 投稿ステータスの更新中にDBへの保存に失敗しました: {e}\n")
 
     def launch_debug_chrome(self):
         """OSに応じて適切なスクリプトを実行し、デバッグ用Chromeを起動する"""
@@ -4,10 +4,12 @@ import re
 import sys
 import time
 import json
-import unicodedata
 from datetime import datetime, timedelta
 import random
-from playwright.sync_api import sync_playwright, Error as PlaywrightError
+import functools
+from typing import NamedTuple
+from urllib.parse import urlsplit
+from playwright.sync_api import sync_playwright, Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
 
 # --- プロジェクトルートの定義 ---
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -15,6 +17,8 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(_
 # --- ユーティリティのインポート ---
 sys.path.insert(0, PROJECT_ROOT)
 from app.utils.selector_utils import convert_to_robust_selector
+from app.utils.json_utils import save_json_atomic
+from app.utils.browser_utils import block_resources, connect_browser, save_error_screenshot
 
 # --- DB/出力ディレクトリの定義 ---
 DB_DIR = os.path.join(PROJECT_ROOT, "db")
@@ -24,112 +28,272 @@ OUTPUT_DIR = os.path.join(PROJECT_ROOT, "output")
 TARGET_URL = "https://room.rakuten.co.jp/items"
 DB_JSON_FILE = "engagement_data.json"
 COMMENT_TEMPLATES_FILE = os.path.join(PROJECT_ROOT, "comment_templates.json")
+DEFAULT_COMMENT_TEXT = "ご訪問ありがとうございます！" # カテゴリに合うテンプレートが無い場合のコメント
+REQUEST_INTERVAL_SEC = 0.5 # フェーズ4でプロフィールページを開く最小間隔（秒）
+NOTIFICATION_ITEM_SELECTOR = "li[ng-repeat='notification in notifications.activityNotifications']"
+# GUI (app.py) から起動された場合は結果をテーブルで表示するため、ユーザー一覧のログ出力を省略する
+GUI_MODE = os.environ.get("GUI_MODE") == "1"
+
+# 通知の文言と、集約時に加算するカウンターの対応（1件の通知は1つのアクションのみを表す）
+_ACTION_KEYS = (
+    ("いいねしました", 'like_count'),
+    ("コレ！しました", 'collect_count'),
+    ("あなたをフォローしました", 'follow_count'),
+    ("あなたの商品にコメントしました", 'comment_count'),
+)
+
+# --- ブラウザ内で実行するJavaScript ---
+# 通知リストの各項目から、フェーズ1で必要な情報をまとめて抽出する（項目ごとのCDP往復を避けるため）
+# 名前が非表示の項目とプロフィール画像が未設定の項目はブラウザ側で除外し、総件数(total)と残った項目(items)を返す
+EXTRACT_NOTIFICATIONS_JS = """
+(selector) => {
+    const isVisible = el => !!el && !!(el.offsetWidth || el.offsetHeight || el.getClientRects().length);
+    const listItems = Array.from(document.querySelectorAll(selector));
+    const items = [];
+    for (const li of listItems) {
+        const nameEl = li.querySelector('span.notice-name span.strong');
+        if (!isVisible(nameEl)) continue;
+        const src = li.querySelector('div.left-img img')?.getAttribute('src') || '';
+        if (!src || src.includes('img_noprofile.gif')) continue;
+        const unfollowEl = Array.from(li.querySelectorAll('span.follow'))
+            .find(el => el.innerText.includes('未フォロー') && isVisible(el));
+        items.push({
+            name: nameEl.innerText,
+            src: src,
+            action_text: li.querySelector('div.right-text > p')?.innerText || '',
+            action_timestamp: li.querySelector('span.notice-time')?.getAttribute('title') || '',
+            is_following: !unfollowEl,
+        });
+    }
+    return { total: listItems.length, items: items };
+}
+"""
+
+# 現在の通知件数を返し、ページ最下部までスクロールして次の通知の遅延読み込みを促す
+SCROLL_AND_COUNT_JS = """
+(selector) => {
+    const count = document.querySelectorAll(selector).length;
+    window.scrollTo(0, document.body.scrollHeight);
+    return count;
+}
+"""
+
+# ユーザーIDを含むアイコン画像を持つ通知を探し、アイコンのリンク先(プロフィールURL)を一括で返す
+# href="" や "#"、"javascript:" のリンクは現在のページ等を指すため、ROOM内の別ページを指すhttp(s)のURL以外はnullを返す
+RESOLVE_PROFILE_URLS_JS = """
+([selector, ids]) => {
+    const items = Array.from(document.querySelectorAll(selector));
+    const isProfileUrl = (url) => {
+        try {
+            const u = new URL(url);
+            return (u.protocol === 'http:' || u.protocol === 'https:') && u.host === location.host
+                && !url.includes('#') && url !== location.href;
+        } catch (e) {
+            return false;
+        }
+    };
+    return ids.map(id => {
+        const li = items.find(x => (x.querySelector('div.left-img img')?.getAttribute('src') || '').includes(id));
+        const link = li?.querySelector('div.left-img a[href]');
+        return link && isProfileUrl(link.href) ? link.href : null;
+    });
+}
+"""
 
 # --- ロガーの基本設定 ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# --- 名前抽出用の区切り文字 ---
+# 区切りとみなす記号類（♡は意図的に除外）と、絵文字のUnicodeブロック範囲
+# ☆★♪♭ などは下記の Miscellaneous Symbols の範囲に含まれるため、ここには範囲外の文字のみを列挙する
+_SEP_SET = frozenset(ord(c) for c in "|│￤＠@/｜*＊※#＃")
+# 連続するブロックは1つの範囲にまとめ、コードポイント順に並べる
+_SEP_RANGES = (
+    (0x2600, 0x27BF),    # Miscellaneous Symbols, Dingbats
+    (0x1F1E0, 0x1F1FF),  # Flags (iOS)
+    (0x1F300, 0x1F64F),  # Miscellaneous Symbols and Pictographs, Emoticons
+    (0x1F680, 0x1F6FF),  # Transport & Map Symbols
+    (0x1F900, 0x1F9FF),  # Supplemental Symbols and Pictographs
+)
+
+def _is_sep(cp: int) -> bool:
+    """コードポイントが名前の区切り文字（記号・絵文字）かどうかを判定する。"""
+    return cp in _SEP_SET or any(lo <= cp <= hi for lo, hi in _SEP_RANGES)
+
+class Notification(NamedTuple):
+    """
+    お知らせページから取得した通知1件分の情報。
+    件数が多くなるフェーズ1〜2では、辞書よりも省メモリで属性アクセスが速いタプルで保持する。
+    """
+    id: str
+    name: str
+    profile_image_url: str
+    action_text: str
+    action_timestamp: str
+    action_dt: datetime # action_timestampを一度だけパースしたもの（比較用）
+    is_following: bool
+
 def extract_natural_name(full_name: str) -> str:
     """
     絵文字や装飾が含まれる可能性のあるフルネームから、自然な名前の部分を抽出する。
     例: '春🌷身長が3cm伸びました😳' -> '春'
-    例: '𝐬𝐚𝐲𝐮¹²²⁵𝓡' -> 'sayu'
     例: '❁mizuki❁' -> 'mizuki'
     """
     if not full_name:
         return ""
 
-    # Unicodeの絵文字や特定の記号を区切り文字として定義
-    separators = re.compile(
-        r'['
-        u'\u2600-\u27BF'          # Miscellaneous Symbols
-        u'\U0001F300-\U0001F5FF'  # Miscellaneous Symbols and Pictographs
-        u'\U0001F600-\U0001F64F'  # Emoticons
-        u'\U0001F680-\U0001F6FF'  # Transport & Map Symbols
-        u'\U0001F1E0-\U0001F1FF'  # Flags (iOS)
-        u'\U0001F900-\U0001F9FF'  # Supplemental Symbols and Pictographs
-        u'|│￤＠@/｜*＊※☆★♪#＃♭🎀' # 全角・半角の記号類
-        u'|│￤＠@/｜*＊※☆★♪#＃♭🎀' # 全角・半角の記号類（♡は意図的に除外）
-        u']+' # 連続する区切り文字を一つとして扱う
-    )
-
-    # 区切り文字で文字列を分割
-    parts = separators.split(full_name)
-
-    # 分割されたパーツから、空でない最初の要素を探す
-    # 分割されたパーツから、空でない最初の要素を候補とする
-    name_candidate = ""
-    for part in parts:
-        cleaned_part = part.strip()
+    # 区切り文字で区切られたパーツを先頭から走査し、空白以外を含む最初のパーツを名前として返す
+    start = None
+    for i, c in enumerate(full_name):
+        if _is_sep(ord(c)):
+            if start is not None:
+                cleaned_part = full_name[start:i].strip()
+                if cleaned_part:
+                    return cleaned_part
+                start = None
+        elif start is None:
+            start = i
+
+    if start is not None:
+        cleaned_part = full_name[start:].strip()
         if cleaned_part:
             return cleaned_part
-            name_candidate = cleaned_part
-            break
-    
-    if not name_candidate:
-        return full_name.strip() # 候補が見つからなければ元の名前を返す
 
     # 適切なパーツが見つからなかった場合（名前全体が記号だった場合など）、元の名前をフォールバックとして返す
     return full_name.strip()
-    # 候補の文字列を正規化 (例: 𝐬𝐚𝐲𝐮¹²²⁵𝓡 -> sayu1225R)
-    normalized_name = unicodedata.normalize('NFKC', name_candidate)
 
-    # 正規化された名前から、最初の数字や特定の記号までの部分を抽出
-    match = re.search(r'[\d_‐-]', normalized_name)
-    if match:
-        return normalized_name[:match.start()]
-    
-    return normalized_name
+# プロフィール画像URLの末尾（拡張子・クエリを除いたファイル名）をユーザーIDとして取り出す
+_ID_RE = re.compile(r'/([^/]+?)(?:\.\w+)?(?:\?.*)?$')
 
-def get_latest_timestamp_from_db(db_path: str) -> datetime:
+def extract_user_id(profile_image_url: str) -> str:
     """
-    DBファイルから最も新しいlatest_action_timestampをdatetimeオブジェクトとして取得する。
+    プロフィール画像のURLからユーザーIDを抽出する。
+    例: 'https://.../4c48...c2a1.68.9.22.3.jpg?1234' -> '4c48...c2a1.68.9.22.3'
     """
-    latest_timestamp = datetime.min # 比較用の非常に古い日時で初期化
+    # 一般的な形式のURLは文字列操作だけで処理し、それ以外の場合のみ正規表現を使う
+    base, slash, tail = profile_image_url.split('?', 1)[0].rpartition('/')
+    stem, dot, ext = tail.rpartition('.')
+    if dot and ext and all(c.isalnum() or c == '_' for c in ext):
+        tail = stem
+    if slash and tail:
+        return tail
+
+    match = _ID_RE.search(profile_image_url)
+    return match.group(1) if match else "unknown"
+
+def load_comment_templates():
+    """
+    コメントテンプレートファイルを読み込む。ファイルが存在しない場合はNoneを返す。
+    """
+    try:
+        with open(COMMENT_TEMPLATES_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except json.JSONDecodeError as e:
+        logging.error(f"コメントテンプレートファイルの読み込みに失敗しました: {e}")
+        return {}
+
+# テンプレートは実行中に変わらないため、モジュール読み込み時に一度だけ読み込む
+_COMMENT_TEMPLATES = load_comment_templates()
+
+@functools.lru_cache(maxsize=None)
+def _remove_name_placeholder(comment_template: str) -> str:
+    """テンプレートから名前のプレースホルダー部分を削除する（同じテンプレートの変換結果は使い回す）。"""
+    return comment_template.replace("{user_name}さん、", "").strip()
+
+def _is_profile_url(url: str, current_url: str) -> bool:
+    """
+    URLがROOM内の別ページを指すhttp(s)のURLかどうかを判定する（RESOLVE_PROFILE_URLS_JS と同じ条件）。
+    """
+    if not url or '#' in url or url == current_url:
+        return False
+    parts = urlsplit(url)
+    return parts.scheme in ("http", "https") and parts.netloc == urlsplit(TARGET_URL).netloc
+
+def load_existing_users(db_path: str) -> dict:
+    """
+    既存のDBファイルを読み込み、ユーザーIDをキーとした辞書として返す。
+    """
+    existing_users = {}
     if not os.path.exists(db_path):
-        return latest_timestamp
+        return existing_users
 
     try:
         with open(db_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        if not data:
-            return latest_timestamp
-
-        for item in data:
-            ts_str = item.get('latest_action_timestamp')
-            if ts_str:
-                ts_dt = datetime.strptime(ts_str, '%Y-%m-%d %H:%M:%S')
-                if ts_dt > latest_timestamp:
-                    latest_timestamp = ts_dt
-    except (json.JSONDecodeError, FileNotFoundError) as e:
-        logging.warning(f"DBファイルの読み込み中に軽微なエラーが発生しました: {e}")
-    
+            existing_data = json.load(f)
+        for user in existing_data or []:
+            if 'id' not in user:
+                continue
+            # 日付形式の検証は読み込み時に一度だけ行い、以降のフェーズでは再パースしない
+            ts_str = user.get('latest_action_timestamp')
+            try:
+                datetime.strptime(ts_str, '%Y-%m-%d %H:%M:%S')
+            except (TypeError, ValueError):
+                logging.warning(f"ユーザー '{user.get('name')}' の不正な日付形式のレコードをスキップ: {ts_str}")
+                continue
+            existing_users[user['id']] = user
+    except (json.JSONDecodeError, FileNotFoundError):
+        logging.warning(f"既存のDBファイル({db_path})の読み込みに失敗しました。新しいDBを作成します。")
+
+    return existing_users
+
+def get_latest_timestamp(existing_users: dict) -> datetime:
+    """
+    読み込み済みのDBデータから最も新しいlatest_action_timestampをdatetimeオブジェクトとして取得する。
+    """
+    latest_timestamp = datetime.min # 比較用の非常に古い日時で初期化
+    for item in existing_users.values():
+        ts_str = item.get('latest_action_timestamp')
+        if ts_str:
+            ts_dt = datetime.strptime(ts_str, '%Y-%m-%d %H:%M:%S')
+            if ts_dt > latest_timestamp:
+                latest_timestamp = ts_dt
+
     return latest_timestamp
 
+def categorize_user(user: dict) -> str:
+    """
+    集約済みのアクション数とフォロー状況から、ユーザーのカテゴリを判定する。
+    どの条件にも当てはまらない場合は「その他」を返す。
+    """
+    like_count = user['like_count']
+    is_following = user['is_following']
+    follow_count = user['follow_count']
+    collect_count = user['collect_count']
+
+    # いいねが無い場合は、新規フォローのみかどうかだけで決まる
+    if like_count == 0:
+        return "新規フォロー" if follow_count > 0 else "その他"
+    if like_count >= 3:
+        return "いいね多謝"
+    if follow_count > 0:
+        return "新規フォロー＆いいね感謝"
+    if not is_following:
+        return "未フォロー＆いいね感謝"
+    if collect_count > 0:
+        return "いいね＆コレ！感謝"
+    return "いいね感謝"
+
 def main():
     """
     楽天ROOMのお知らせページからユーザー情報をスクレイピングするメイン関数
     """
     with sync_playwright() as p:
         # --- 1. ブラウザの起動 ---
-        logging.info("デバッグモードで起動中のChrome (ポート9222) に接続します。")
-        browser = None
-        for i in range(5):
-            try:
-                browser = p.chromium.connect_over_cdp("http://localhost:9222")
-                logging.info("Chromeへの接続に成功しました。")
-                break
-            except Exception:
-                logging.warning(f"接続に失敗しました。3秒後に再試行します... ({i+1}/5)")
-                time.sleep(3)
-
-        if not browser:
+        try:
+            browser = connect_browser(p, wait_timeout=15)
+        except PlaywrightError:
             logging.error("Chromeへの接続に失敗しました。")
             logging.error("アプリが起動したChromeウィンドウを閉じずに、このスクリプトを実行してください。")
             return
 
+        page = None
         try:
             context = browser.contexts[0]
             page = context.new_page()
+            # テキストと属性だけを読むため、画像・動画・フォントは読み込まない（img要素のsrc属性は取得できる）
+            block_resources(page, {"image", "media", "font"})
 
             # --- 2. ページ遷移 ---
             logging.info(f"{TARGET_URL} にアクセスします。")
@@ -153,8 +317,8 @@ def main():
             logging.info("遅延読み込みされるコンテンツを表示するため、ページをスクロールします。")
             last_count = 0
             for attempt in range(4):
-                notification_list_items = page.locator("li[ng-repeat='notification in notifications.activityNotifications']")
-                current_count = notification_list_items.count()
+                # 件数の取得とスクロールを1回のevaluateで行う
+                current_count = page.evaluate(SCROLL_AND_COUNT_JS, NOTIFICATION_ITEM_SELECTOR)
 
                 if attempt > 2 and current_count == last_count:
                     logging.info("スクロールしても新しいアクティビティ通知は読み込まれませんでした。")
@@ -162,116 +326,94 @@ def main():
 
                 last_count = current_count
                 logging.info(f"  スクロール {attempt + 1}回目: {current_count}件のアクティビティ通知を検出。")
-                page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-                page.wait_for_timeout(1500)
+                # 固定で1.5秒待つのではなく、通知が追加され次第すぐに次へ進む（最大1.5秒）
+                try:
+                    page.wait_for_function(
+                        "([selector, n]) => document.querySelectorAll(selector).length > n",
+                        arg=[NOTIFICATION_ITEM_SELECTOR, current_count],
+                        timeout=1500
+                    )
+                except PlaywrightTimeoutError:
+                    pass
 
             # --- 4. データ抽出 ---
-            logging.info(f"--- フェーズ1: {notification_list_items.count()}件の通知から基本情報を収集します。 ---")
+            extracted = page.evaluate(EXTRACT_NOTIFICATIONS_JS, NOTIFICATION_ITEM_SELECTOR)
+            logging.info(f"--- フェーズ1: {extracted['total']}件の通知から基本情報を収集します。 ---")
             all_notifications = []
-            for item in notification_list_items.all():
-                try:
-                    user_name_element = item.locator("span.notice-name span.strong").first
-                    if not user_name_element.is_visible():
+            for item in extracted['items']:
+                user_name = item['name'].strip()
+                profile_image_url = item['src']
+
+                if user_name:
+                    try:
+                        action_dt = datetime.strptime(item['action_timestamp'], '%Y-%m-%d %H:%M:%S')
+                    except ValueError:
+                        logging.warning(f"通知の日時を解析できないためスキップします: {user_name} ({item['action_timestamp']})")
                         continue
 
-                    user_name = user_name_element.inner_text().strip()
-                    profile_image_url = item.locator("div.left-img img").get_attribute("src")
+                    user_id = extract_user_id(profile_image_url)
 
-                    if "img_noprofile.gif" in profile_image_url:
-                        continue
+                    all_notifications.append(Notification(
+                        id=user_id, name=user_name,
+                        profile_image_url=profile_image_url,
+                        action_text=item['action_text'],
+                        action_timestamp=item['action_timestamp'],
+                        action_dt=action_dt,
+                        is_following=item['is_following']
+                    ))
 
-                    if user_name:
-                        user_id = "unknown"
-                        match = re.search(r'/([^/]+?)(?:\.\w+)?(?:\?.*)?$', profile_image_url)
-                        if match: user_id = match.group(1)
-
-                        action_text = item.locator("div.right-text > p").first.inner_text()
-                        action_timestamp = item.locator("span.notice-time").first.get_attribute("title")
-                        is_following = not item.locator("span.follow:has-text('未フォロー')").is_visible()
-
-                        all_notifications.append({
-                            'id': user_id, 'name': user_name.strip(),
-                            'profile_image_url': profile_image_url,
-                            'action_text': action_text,
-                            'action_timestamp': action_timestamp,
-                            'is_following': is_following
-                        })
-                except Exception as item_error:
-                    logging.warning(f"通知アイテムの取得中にエラー: {item_error}")
-
-            # --- フェーズ2: ユーザー単位で情報を集約し、カテゴリを付与 ---
+            # --- フェーズ2: ユーザー単位で情報を集約 ---
             logging.info(f"--- フェーズ2: {len(all_notifications)}件の通知をユーザー単位で集約します。 ---")
             aggregated_users = {}
+            latest_action_dts = {} # ユーザーIDごとの最新アクション日時（DBには保存しない比較用の値）
+            # 新しい順に並べておけば、ユーザーごとに最初に出現した通知が最新のアクションになる
+            # （安定ソートのため、同時刻の通知はページ上の順序が保たれる）
+            all_notifications.sort(key=lambda n: n.action_dt, reverse=True)
             for notification in all_notifications:
-                user_id = notification['id']
-                if user_id not in aggregated_users:
-                    aggregated_users[user_id] = {
-                        'id': user_id, 'name': notification['name'],
+                user_id = notification.id
+                action_text = notification.action_text
+                user = aggregated_users.get(user_id)
+                if user is None:
+                    user = aggregated_users[user_id] = {
+                        'id': user_id, 'name': notification.name,
                         'like_count': 0, 'collect_count': 0,
                         'follow_count': 0, 'comment_count': 0, # フォローとコメントのカウンターを追加
-                        'is_following': notification['is_following'],
-                        'latest_action_timestamp': notification['action_timestamp']
+                        'is_following': notification.is_following,
+                        'latest_action_text': action_text,
+                        'latest_action_timestamp': notification.action_timestamp
                     }
+                    latest_action_dts[user_id] = notification.action_dt
                 
-                if "いいねしました" in notification['action_text']:
-                    aggregated_users[user_id]['like_count'] += 1
-                if "コレ！しました" in notification['action_text']:
-                    aggregated_users[user_id]['collect_count'] += 1
-                if "あなたをフォローしました" in notification['action_text']:
-                    aggregated_users[user_id]['follow_count'] += 1
-                if "あなたの商品にコメントしました" in notification['action_text']:
-                    aggregated_users[user_id]['comment_count'] += 1
-
-                if notification['action_timestamp'] > aggregated_users[user_id]['latest_action_timestamp']:
-                    aggregated_users[user_id].update({
-                        'is_following': notification['is_following'],
-                        'latest_action_text': notification['action_text'],
-                        'latest_action_timestamp': notification['action_timestamp']
-                    })
+                for needle, key in _ACTION_KEYS:
+                    if needle in action_text:
+                        user[key] += 1
+                        break
             logging.info(f"  -> {len(aggregated_users)}人のユニークユーザーに集約しました。")
             
-            categorized_users = []
-            for user in aggregated_users.values():
-                like_count = user['like_count']
-                is_following = user['is_following']
-                follow_count = user['follow_count']
-                collect_count = user['collect_count']
-                
-                if like_count >= 3:
-                    user['category'] = "いいね多謝"
-                elif follow_count > 0 and like_count > 0:
-                    user['category'] = "新規フォロー＆いいね感謝"
-                elif like_count > 0 and not is_following: 
-                    user['category'] = "未フォロー＆いいね感謝"
-                elif like_count > 0 and collect_count > 0:
-                    user['category'] = "いいね＆コレ！感謝"
-                elif follow_count > 0 and like_count == 0:
-                    user['category'] = "新規フォロー"
-                elif like_count > 0:
-                    user['category'] = "いいね感謝"
-                else:
-                    user['category'] = "その他"
-                
-                # 「その他」カテゴリは処理対象から除外
-                if user['category'] != "その他":
-                    categorized_users.append(user)
-
-            # --- フェーズ3: 時間条件でフィルタリングし、優先度順にソート ---
+            # --- フェーズ3: 時間条件でフィルタリングしてカテゴリを付与し、優先度順にソート ---
             logging.info(f"--- フェーズ3: 時間条件でユーザーをフィルタリングします。 ---")
             
             # 条件設定
             db_path = os.path.join(DB_DIR, DB_JSON_FILE)
-            latest_db_timestamp = get_latest_timestamp_from_db(db_path)
+            # ここで読み込んだDBは時刻の判定とフェーズ4（URLの再利用）にのみ使い、フェーズ6のマージ直前に読み直す
+            existing_users = load_existing_users(db_path)
+            latest_db_timestamp = get_latest_timestamp(existing_users)
             twelve_hours_ago = datetime.now() - timedelta(hours=12)
             
             logging.info(f"  - DBの最新時刻: {latest_db_timestamp.strftime('%Y-%m-%d %H:%M:%S') if latest_db_timestamp > datetime.min else '（データなし）'}")
             logging.info(f"  - 12時間前の時刻: {twelve_hours_ago.strftime('%Y-%m-%d %H:%M:%S')}")
 
             users_to_process = []
-            for user in categorized_users:
-                action_time = datetime.strptime(user['latest_action_timestamp'], '%Y-%m-%d %H:%M:%S')
+            for user in aggregated_users.values():
+                action_time = latest_action_dts[user['id']]
                 # 条件: 12時間以内で、かつDBの最新時刻より新しい
-                if action_time > twelve_hours_ago and action_time > latest_db_timestamp:
+                if not (action_time > twelve_hours_ago and action_time > latest_db_timestamp):
+                    continue
+
+                # 時間条件を満たしたユーザーにだけカテゴリを付与し、「その他」カテゴリは処理対象から除外
+                category = categorize_user(user)
+                if category != "その他":
+                    user['category'] = category
                     users_to_process.append(user)
             
             logging.info(f"  -> {len(users_to_process)}人のユーザーが処理対象です。")
@@ -289,30 +431,58 @@ def main():
             )
             
             # --- フェーズ4: URL取得 ---
+            # ユーザーIDはアイコン画像のファイル名から得たハッシュで、プロフィールURL(例: /room_xxxx/items)とは対応しないため、
+            # URLをIDから組み立てることはできない。DBのキャッシュ→通知リストのリンク→クリック遷移の順に取得する。
             logging.info(f"--- フェーズ4: {len(sorted_users)}人のプロフィールURLを取得します。 ---")
             final_user_data = []
             last_scroll_position = 0  # スクロール位置を記憶する変数を初期化
 
+            cached_url_count = 0
+            resolved_url_count = 0
+
+            # 通知リスト内のリンクからプロフィールURLを1回のevaluateでまとめて取得し、クリックによる遷移を最小限にする
+            try:
+                resolved_urls = page.evaluate(RESOLVE_PROFILE_URLS_JS, [NOTIFICATION_ITEM_SELECTOR, [u['id'] for u in sorted_users]])
+            except PlaywrightError as e:
+                logging.warning(f"  プロフィールURLの一括取得に失敗しました。個別に取得します: {e}")
+                resolved_urls = [None] * len(sorted_users)
+
+            notifications_url = page.url
             for i, user_info in enumerate(sorted_users):
-                logging.debug(f"  {i+1}/{len(sorted_users)}: 「{user_info['name']}」のURLを取得中...")
+                # 過去の実行で取得済みのURLがあれば、ページ遷移せずに再利用する
+                # （"取得失敗" や、過去に保存されたお知らせページ自体のURLなどは再利用しない）
+                cached = existing_users.get(user_info['id'])
+                if cached and _is_profile_url(cached.get('profile_page_url'), notifications_url):
+                    user_info['profile_page_url'] = cached['profile_page_url']
+                    final_user_data.append(user_info)
+                    cached_url_count += 1
+                    continue
+
+                # リンクから取得できたURLがあれば、ページ遷移せずにそのまま使う
+                if resolved_urls[i]:
+                    user_info['profile_page_url'] = resolved_urls[i]
+                    final_user_data.append(user_info)
+                    resolved_url_count += 1
+                    continue
+
+                logging.debug("  %d/%d: 「%s」のURLを取得中...", i + 1, len(sorted_users), user_info['name'])
+                request_started = time.monotonic()
                 try:
                     # 前回のスクロール位置に戻す
                     if last_scroll_position > 0:
                         page.evaluate(f"window.scrollTo(0, {last_scroll_position})")
-                        logging.debug(f"  スクロール位置を {last_scroll_position}px に復元しました。")
+                        logging.debug("  スクロール位置を %spx に復元しました。", last_scroll_position)
 
-                    user_li_locator = page.locator(f"li[ng-repeat='notification in notifications.activityNotifications']:has-text(\"{user_info['name']}\")").first
+                    # 名前のテキスト検索ではなく、ユーザーIDを含むアイコン画像の属性で通知を特定する
+                    user_li_locator = page.locator(f"{NOTIFICATION_ITEM_SELECTOR}:has(div.left-img img[src*=\"{user_info['id']}\"])").first
                     image_container_locator = user_li_locator.locator("div.left-img")
                     
-                    max_scroll_attempts_find = 15
-                    is_found = False
-                    for attempt in range(max_scroll_attempts_find):
-                        if image_container_locator.count() > 0 and image_container_locator.is_visible():
-                            is_found = True
-                            break
-                        logging.debug(f"  ユーザー「{user_info['name']}」の画像が見つかりません。スクロールします... ({attempt + 1}/{max_scroll_attempts_find})")
-                        page.evaluate("window.scrollBy(0, 500)")
-                        time.sleep(1)      
+                    # スクロールしながら可視状態になるまでの待機はPlaywrightに任せる
+                    try:
+                        image_container_locator.scroll_into_view_if_needed(timeout=5000)
+                        is_found = True
+                    except PlaywrightError:
+                        is_found = False
 
                     if not is_found:
                         raise PlaywrightError(f"スクロールしてもユーザー「{user_info['name']}」の要素が見つかりませんでした。")
@@ -322,7 +492,7 @@ def main():
                     image_container_locator.click()
                     
                     user_info['profile_page_url'] = page.url
-                    logging.debug(f"  -> 取得したURL: {page.url}")
+                    logging.debug("  -> 取得したURL: %s", page.url)
                     
                     page.go_back(wait_until="domcontentloaded")
                 except Exception as url_error:
@@ -330,22 +500,35 @@ def main():
                     user_info['profile_page_url'] = "取得失敗"
                 
                 final_user_data.append(user_info)
-                time.sleep(0.5)
 
-            logging.info("\n--- 分析完了: 処理対象ユーザー一覧 ---")
-            for i, user in enumerate(final_user_data):
-                logging.info(f"  {i+1:2d}. {user['name']:<20} (カテゴリ: {user['category']}, URL: {user.get('profile_page_url', 'N/A')})")
-            logging.info("------------------------------------")
+                # 固定で待機するのではなく、ページ遷移自体が最小間隔に満たなかった場合のみ残り時間だけ待機する
+                sleep_for = request_started + REQUEST_INTERVAL_SEC - time.monotonic()
+                if sleep_for > 0:
+                    # time.sleep の間はルートハンドラが実行されず通信が止まるため、page.wait_for_timeout で待つ
+                    page.wait_for_timeout(sleep_for * 1000)
+
+            if cached_url_count:
+                logging.info(f"  -> {cached_url_count}人はDBに保存済みのURLを再利用しました。")
+            if resolved_url_count:
+                logging.info(f"  -> {resolved_url_count}人は通知リストのリンクからURLを取得しました。")
+
+            if not GUI_MODE:
+                logging.info("\n--- 分析完了: 処理対象ユーザー一覧 ---")
+                for i, user in enumerate(final_user_data):
+                    logging.info(f"  {i+1:2d}. {user['name']:<20} (カテゴリ: {user['category']}, URL: {user.get('profile_page_url', 'N/A')})")
+                logging.info("------------------------------------")
 
             # --- フェーズ5: コメント生成 ---
             logging.info(f"--- フェーズ5: {len(final_user_data)}人のユーザーにコメントを紐付けます。 ---")
             try:
-                with open(COMMENT_TEMPLATES_FILE, 'r', encoding='utf-8') as f:
-                    comment_templates = json.load(f)
+                comment_templates = _COMMENT_TEMPLATES
+                if comment_templates is None:
+                    raise FileNotFoundError(COMMENT_TEMPLATES_FILE)
+                fallback_templates = comment_templates.get('その他', [])
                 
                 for user in final_user_data:
                     category = user.get('category', 'その他')
-                    templates = comment_templates.get(category, comment_templates.get('その他', []))
+                    templates = comment_templates.get(category, fallback_templates)
                     if templates:
                         comment_template = random.choice(templates)
                         natural_name = extract_natural_name(user.get('name', ''))
@@ -354,9 +537,9 @@ def main():
                             user['comment_text'] = comment_template.format(user_name=natural_name)
                         else:
                             # 名前が取得できなかったり長すぎる場合は、プレースホルダー部分を削除して不自然さをなくす
-                            user['comment_text'] = comment_template.replace("{user_name}さん、", "").strip()
+                            user['comment_text'] = _remove_name_placeholder(comment_template)
                     else:
-                        user['comment_text'] = "ご訪問ありがとうございます！" # フォールバック
+                        user['comment_text'] = DEFAULT_COMMENT_TEXT # フォールバック
             except FileNotFoundError:
                 logging.error(f"コメントテンプレートファイルが見つかりません: {COMMENT_TEMPLATES_FILE}")
             except Exception as e:
@@ -365,20 +548,9 @@ def main():
             # --- フェーズ6: 結果を既存DBとマージして保存 ---
             try:
                 os.makedirs(DB_DIR, exist_ok=True)
-                db_path = os.path.join(DB_DIR, DB_JSON_FILE)
-
-                # 1. 既存DBを読み込む
-                existing_users = {}
-                if os.path.exists(db_path):
-                    try:
-                        with open(db_path, 'r', encoding='utf-8') as f:
-                            existing_data = json.load(f)
-                            for user in existing_data:
-                                if 'id' in user:
-                                    existing_users[user['id']] = user
-                    except (json.JSONDecodeError, FileNotFoundError):
-                        logging.warning(f"既存のDBファイル({db_path})の読み込みに失敗しました。新しいDBを作成します。")
 
+                # 1. フェーズ4の間にGUIが書き込んだ投稿ステータスを失わないよう、マージ直前に既存DBを読み直す
+                existing_users = load_existing_users(db_path)
                 # 2. 新しいデータをマージ（新しい情報で上書き）
                 logging.info(f"--- フェーズ6: {len(final_user_data)}件の新規・更新データを既存DBとマージします。 ---")
                 for new_user in final_user_data:
@@ -386,36 +558,30 @@ def main():
 
                 # 3. 24時間以上前の古いレコードをフィルタリング
                 logging.info("24時間以上経過した古いレコードをDBから削除します。")
-                twenty_four_hours_ago = datetime.now() - timedelta(hours=24)
-                
-                recent_users = []
-                for user_data in existing_users.values():
-                    action_time_str = user_data.get('latest_action_timestamp')
-                    if action_time_str:
-                        try:
-                            action_time = datetime.strptime(action_time_str, '%Y-%m-%d %H:%M:%S')
-                            if action_time >= twenty_four_hours_ago:
-                                recent_users.append(user_data)
-                        except ValueError:
-                            logging.warning(f"ユーザー '{user_data.get('name')}' の不正な日付形式のレコードをスキップ: {action_time_str}")
+                # 日付形式はDB読み込み時に検証済みで、'%Y-%m-%d %H:%M:%S' は文字列の大小がそのまま時系列順になる
+                cutoff = (datetime.now() - timedelta(hours=24)).strftime('%Y-%m-%d %H:%M:%S')
+                recent_users = [u for u in existing_users.values() if u['latest_action_timestamp'] >= cutoff]
 
                 # 4. フィルタリング後のデータを最新アクション日時で降順ソートして保存
                 final_data_to_save = sorted(recent_users, key=lambda u: u.get('latest_action_timestamp', ''), reverse=True)
-                with open(db_path, 'w', encoding='utf-8') as f:
-                    json.dump(final_data_to_save, f, ensure_ascii=False, indent=4)
+                save_json_atomic(db_path, final_data_to_save)
                 logging.info(f"マージとクリーンアップ後の全{len(final_data_to_save)}件のデータを {db_path} に保存しました。")
             except Exception as e:
                 logging.error(f"JSONファイルへの保存中にエラーが発生しました: {e}")
 
         except Exception as e:
             logging.error(f"処理中にエラーが発生しました: {e}", exc_info=True)
-            screenshot_path = os.path.join(OUTPUT_DIR, "error_screenshot.png")
-            if 'page' in locals() and not page.is_closed(): page.screenshot(path=screenshot_path)
-            logging.info(f"エラー発生時のスクリーンショットを {screenshot_path} に保存しました。")
+            # 画面の状態が原因になり得るブラウザ操作のエラーの場合のみ、スクリーンショットを残す
+            if isinstance(e, PlaywrightError):
+                save_error_screenshot(page, os.path.join(OUTPUT_DIR, "error_screenshot.jpg"))
         finally:
             logging.info("処理が完了しました。")
-            if 'page' in locals() and not page.is_closed():
-                page.close()
+            if page is not None:
+                # ページが既に閉じられていた場合に発生するエラーは無視する
+                try:
+                    page.close()
+                except PlaywrightError:
+                    pass
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
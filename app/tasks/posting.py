@@ -1,8 +1,8 @@
 import logging
 import os
 import sys
-import time
 import argparse
+import json
 from playwright.sync_api import sync_playwright, Error as PlaywrightError
 
 # --- プロジェクトルートの定義 ---
@@ -11,111 +11,150 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(_
 # --- ユーティリティのインポート ---
 sys.path.insert(0, PROJECT_ROOT)
 from app.utils.selector_utils import convert_to_robust_selector
+from app.utils.browser_utils import connect_browser, save_error_screenshot
 
 # --- 出力ディレクトリの定義 ---
 OUTPUT_DIR = os.path.join(PROJECT_ROOT, "output")
 
+# --- セレクター (ハッシュ付きクラス名を変換したものをモジュール読み込み時に一度だけ生成) ---
+POST_CARD_SELECTOR = convert_to_robust_selector("div.container--a3dH_") # 投稿カード全体
+COMMENT_ICON_SELECTOR = convert_to_robust_selector("div.rex-comment-outline--2vaPK")
+POST_IMAGE_LINK_SELECTOR = convert_to_robust_selector("a.link-image--15_8Q")
+COMMENT_BUTTON_SELECTOR = convert_to_robust_selector('div.pointer--3rZ2h:has-text("コメント")')
+
+# --- タイムアウト (ミリ秒。環境変数で調整可能) ---
+DEFAULT_TIMEOUT_MS = int(os.environ.get("DEFAULT_TIMEOUT_MS", "15000")) # 要素の待機・クリック・入力
+NAV_TIMEOUT_MS = int(os.environ.get("NAV_TIMEOUT_MS", "30000")) # ページ遷移と、遷移後の最初の表示
+
+# --- コメント対象の投稿の選び方 ---
+STRATEGY_MAX_COMMENTS = "max-comments" # コメント数が最も多い投稿
+STRATEGY_FIRST = "first" # 最初（最新）の投稿
+
+# --- ブラウザ内で実行するJavaScript ---
+# 各投稿カードのコメント数（コメントアイコンの直後のdivの数値）を一括で取得する。取得できないカードはnull
+COMMENT_COUNTS_JS = """
+([cardSelector, iconSelector]) => Array.from(document.querySelectorAll(cardSelector)).map(card => {
+    const icon = card.querySelector(iconSelector);
+    if (!icon) return 0;
+    let countEl = icon.nextElementSibling;
+    while (countEl && countEl.tagName !== 'DIV') countEl = countEl.nextElementSibling;
+    if (!countEl) return 0;
+    const text = countEl.innerText.trim();
+    return /^-?\\d+$/.test(text) ? parseInt(text, 10) : null;
+})
+"""
+
 # --- ロガーの基本設定 ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def main(profile_page_url: str, comment_text: str):
+class PostingSession:
     """
-    指定されたユーザーのプロフィールページで投稿アクションを実行する。
+    デバッグモードのChromeへのCDP接続を一度だけ確立し、複数ユーザーへの投稿アクションで使い回すセッション。
+    送信前にユーザーが内容を確認できるよう、投稿対象ごとにタブを開いたままにする。
     """
-    if not profile_page_url or not profile_page_url.startswith("http"):
-        logging.error(f"無効なURLです: {profile_page_url}")
-        return
+    def __init__(self):
+        self._playwright = None
+        self.context = None
 
-    logging.info(f"投稿アクションを開始します。対象URL: {profile_page_url}")
-    with sync_playwright() as p:
-        # --- 1. ブラウザの起動 ---
-        logging.info("デバッグモードで起動中のChrome (ポート9222) に接続します。")
+    def __enter__(self):
+        self._playwright = sync_playwright().start()
         try:
-            browser = p.chromium.connect_over_cdp("http://localhost:9222")
-            context = browser.contexts[0]
-            page = context.new_page()
-            logging.info("Chromeへの接続に成功しました。")
-        except PlaywrightError as e:
-            logging.error(f"Chromeへの接続に失敗しました。アプリが起動したChromeが実行されているか確認してください。エラー: {e}")
+            browser = connect_browser(self._playwright)
+            self.context = browser.contexts[0]
+        except PlaywrightError:
+            self._playwright.stop()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._playwright.stop()
+        return False
+
+    def post(self, profile_page_url: str, comment_text: str, strategy: str = STRATEGY_MAX_COMMENTS):
+        """
+        指定されたユーザーのプロフィールページで投稿アクションを実行する。
+        strategy でコメント対象の投稿の選び方（STRATEGY_MAX_COMMENTS / STRATEGY_FIRST）を指定する。
+        """
+        if not profile_page_url or not profile_page_url.startswith("http"):
+            logging.error(f"無効なURLです: {profile_page_url}")
             return
+
+        logging.info(f"投稿アクションを開始します。対象URL: {profile_page_url}")
+        page = None
         try:
+            # page.route を設定するとHTTPキャッシュが無効になり、画像やスクリプトを毎回取得し直すため、投稿タブでは通信を遮断しない
+            page = self.context.new_page()
+            page.set_default_timeout(DEFAULT_TIMEOUT_MS)
+            page.set_default_navigation_timeout(NAV_TIMEOUT_MS)
+
             # --- 2. 対象ユーザーのURLを開く ---
             logging.info(f"プロフィールページにアクセスします: {profile_page_url}")
             
             max_retries = 3
             for attempt in range(max_retries):
                 try:
-                    page.goto(profile_page_url, wait_until="domcontentloaded", timeout=30000)
-                    page.wait_for_load_state("networkidle", timeout=20000)
+                    # ナビゲーションの確定(commit)まで待てば十分。表示の完了は直後の投稿カードの待機で判定する
+                    page.goto(profile_page_url, wait_until="commit")
                     logging.info("ページへのアクセスに成功しました。")
                     break
                 except PlaywrightError as e:
                     logging.warning(f"ページへのアクセスに失敗しました (試行 {attempt + 1}/{max_retries}): {e}")
                     if attempt + 1 == max_retries:
                         raise
-                    time.sleep(3)
+                    # 一時的な失敗はすぐに回復することが多いため、短い待機から始めて倍々に延ばす（0.5秒, 1秒, 最大2秒）
+                    # （time.sleep ではPlaywrightのイベント処理が止まるため、page.wait_for_timeout で待つ）
+                    page.wait_for_timeout(min(500 * (2 ** attempt), 2000))
             
             # ウィンドウを前面に表示してユーザーが操作できるようにする
             page.bring_to_front()
 
             # --- 3. クリック対象の投稿カードを探す ---
-            logging.info("コメント数が最も多い投稿を探しています...")
-            
-            # 投稿カード全体を特定するセレクター
-            post_cards_locator = page.locator(convert_to_robust_selector("div.container--a3dH_"))
-            post_cards_locator.first.wait_for(state="visible", timeout=15000)
-            
-            all_posts = post_cards_locator.all()
-            if not all_posts:
-                logging.error("投稿が見つかりませんでした。")
-                return
+            post_cards_locator = page.locator(POST_CARD_SELECTOR)
+            post_cards_locator.first.wait_for(state="visible", timeout=NAV_TIMEOUT_MS)
 
-            max_comments = -1
-            target_post_card = all_posts[0] # フォールバックとして最初の投稿を保持
+            target_index = 0 # フォールバックとして最初の投稿を保持
+            if strategy == STRATEGY_FIRST:
+                logging.info("最初の投稿を対象とします。")
+            else:
+                logging.info("コメント数が最も多い投稿を探しています...")
 
-            for post_card in all_posts:
-                try:
-                    # コメントアイコンの隣の要素からコメント数を取得
-                    comment_icon = post_card.locator(convert_to_robust_selector("div.rex-comment-outline--2vaPK"))
-                    comment_count_element = comment_icon.locator("xpath=./following-sibling::div[1]")
-                    
-                    comment_count = 0
-                    if comment_count_element.count() > 0:
-                        comment_count = int(comment_count_element.inner_text())
-
-                    if comment_count > max_comments:
-                        max_comments = comment_count
-                        target_post_card = post_card
-                except (ValueError, PlaywrightError):
+                # 全カードのコメント数を1回のevaluateで取得し、最大のものを選ぶ
+                comment_counts = page.evaluate(COMMENT_COUNTS_JS, [POST_CARD_SELECTOR, COMMENT_ICON_SELECTOR])
+                if not comment_counts:
+                    logging.error("投稿が見つかりませんでした。")
+                    return
+
+                max_comments = -1
+                for i, comment_count in enumerate(comment_counts):
                     # コメント数が取得できない場合はスキップ
-                    continue
-            
-            # 1件以上のコメントを持つ投稿が見つからなかった場合、最初の投稿カードを対象とする
-            if max_comments < 1:
-                logging.info("コメントが1件以上の投稿が見つからなかったため、最初の投稿を対象とします。")
-                target_post_card = all_posts[0]
-            else:
-                logging.info(f"コメント数が最も多い投稿が見つかりました (コメント数: {max_comments})。")
-            post_card_image_locator = target_post_card.locator(convert_to_robust_selector("a.link-image--15_8Q"))
+                    if comment_count is not None and comment_count > max_comments:
+                        max_comments = comment_count
+                        target_index = i
+
+                # 1件以上のコメントを持つ投稿が見つからなかった場合、最初の投稿カードを対象とする
+                if max_comments < 1:
+                    logging.info("コメントが1件以上の投稿が見つからなかったため、最初の投稿を対象とします。")
+                    target_index = 0
+                else:
+                    logging.info(f"コメント数が最も多い投稿が見つかりました (コメント数: {max_comments})。")
+            post_card_image_locator = post_cards_locator.nth(target_index).locator(POST_IMAGE_LINK_SELECTOR)
 
             # --- 4. 投稿カードの画像をクリック ---
             logging.info("投稿カードの画像をクリックします...")
             post_card_image_locator.click()
-            page.wait_for_load_state("networkidle", timeout=20000)
-            logging.info(f"クリック後のページに遷移しました: {page.url}")
 
             # --- 5. コメントボタンをクリック ---
+            # 解析用の通信で networkidle は長く待たされるため、次に操作するコメントボタンだけを待つ
+            # （click と fill は対象が表示され操作可能になるまで自動で待機するため、事前の wait_for は行わない）
             logging.info("コメントボタンを探してクリックします...")
-            original_comment_selector = 'div.pointer--3rZ2h:has-text("コメント")'
-            comment_button_locator = page.locator(convert_to_robust_selector(original_comment_selector))
-            comment_button_locator.wait_for(state="visible", timeout=15000)
+            comment_button_locator = page.locator(COMMENT_BUTTON_SELECTOR)
             comment_button_locator.click()
+            logging.info(f"クリック後のページに遷移しました: {page.url}")
             logging.info("コメントボタンをクリックしました。")
 
             # --- 6. コメントを入力 ---
             logging.info("コメント入力欄にテキストを入力します...")
             comment_textarea_locator = page.locator('textarea[placeholder="コメントを書いてください"]')
-            comment_textarea_locator.wait_for(state="visible", timeout=15000)
             comment_textarea_locator.fill(comment_text)
 
             logging.info("--------------------------------------------------")
@@ -125,15 +164,49 @@ def main(profile_page_url: str, comment_text: str):
 
         except PlaywrightError as e:
             logging.error(f"投稿アクション中にエラーが発生しました: {e}")
-            screenshot_path = os.path.join(OUTPUT_DIR, "error_post_action_screenshot.png")
-            if 'page' in locals() and not page.is_closed(): page.screenshot(path=screenshot_path)
-            logging.info(f"エラー発生時のスクリーンショットを {screenshot_path} に保存しました。")
-        finally:
-            logging.info("投稿アクションのスクリプトは完了しましたが、ブラウザは開いたままです。")
+            save_error_screenshot(page, os.path.join(OUTPUT_DIR, "error_post_action_screenshot.jpg"))
+
+def run_all(targets: list, strategy: str = STRATEGY_MAX_COMMENTS):
+    """
+    複数ユーザーへの投稿アクションを、1つのCDP接続でまとめて実行する。
+
+    Args:
+        targets (list): 'profile_page_url' と 'comment_text' を持つ辞書のリスト。
+        strategy (str): コメント対象の投稿の選び方。
+    """
+    # --- 1. ブラウザへの接続 ---
+    try:
+        with PostingSession() as session:
+            for i, target in enumerate(targets):
+                logging.info(f"=== 投稿対象 {i + 1}/{len(targets)} ===")
+                session.post(target.get('profile_page_url'), target.get('comment_text', ''), strategy)
+    except PlaywrightError as e:
+        logging.error(f"Chromeへの接続に失敗しました。アプリが起動したChromeが実行されているか確認してください。エラー: {e}")
+        return
+    logging.info("投稿アクションのスクリプトは完了しましたが、ブラウザは開いたままです。")
+
+def main(profile_page_url: str, comment_text: str, strategy: str = STRATEGY_MAX_COMMENTS):
+    """
+    指定されたユーザーのプロフィールページで投稿アクションを実行する。
+    """
+    run_all([{'profile_page_url': profile_page_url, 'comment_text': comment_text}], strategy)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="楽天ROOM 投稿アクションツール")
-    parser.add_argument('--url', type=str, required=True, help='投稿アクションの対象となるプロフィールURL')
-    parser.add_argument('--comment', type=str, required=True, help='投稿するコメント文')
+    parser.add_argument('--url', type=str, help='投稿アクションの対象となるプロフィールURL')
+    parser.add_argument('--comment', type=str, help='投稿するコメント文')
+    parser.add_argument('--targets-file', type=str, help='一括投稿の対象（profile_page_url と comment_text を持つ辞書のリスト）を記述したJSONファイル')
+    parser.add_argument('--delete-targets-file', action='store_true', help='読み込み後に --targets-file のファイルを削除する（GUIが投稿ごとに作成する一時ファイル用）')
+    parser.add_argument('--strategy', choices=[STRATEGY_MAX_COMMENTS, STRATEGY_FIRST], default=STRATEGY_MAX_COMMENTS,
+                        help='コメント対象の投稿の選び方（max-comments: コメント数が最も多い投稿, first: 最初の投稿）')
     args = parser.parse_args()
-    main(args.url, args.comment)
\ No newline at end of file
+    if args.targets_file:
+        with open(args.targets_file, 'r', encoding='utf-8') as f:
+            targets = json.load(f)
+        if args.delete_targets_file:
+            os.remove(args.targets_file)
+        run_all(targets, args.strategy)
+    elif args.url and args.comment is not None:
+        main(args.url, args.comment, args.strategy)
+    else:
+        parser.error("--url と --comment、または --targets-file を指定してください。")
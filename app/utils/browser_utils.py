@@ -0,0 +1,93 @@
+import logging
+import os
+import socket
+import time
+from playwright.sync_api import Browser, Page, Playwright, Error as PlaywrightError
+
+# アプリが起動したデバッグモードのChromeのCDPエンドポイント
+CDP_HOST = "localhost"
+CDP_PORT = 9222
+CDP_URL = f"http://{CDP_HOST}:{CDP_PORT}"
+
+# エラー発生時にスクリーンショットを保存するかどうか（環境変数 SCREENSHOT_ON_ERROR=0 で無効化できる）
+SCREENSHOT_ON_ERROR = os.environ.get("SCREENSHOT_ON_ERROR", "1") != "0"
+
+# 解析・広告用の通信として常に遮断するURLのキーワード
+BLOCKED_URL_KEYWORDS = ("google-analytics", "googletagmanager", "doubleclick")
+
+def block_resources(page: Page, resource_types: set) -> None:
+    """
+    指定された種類のリソースと解析用の通信を遮断し、ページ読み込みの転送量を削減します。
+
+    Args:
+        page (Page): 対象のPlaywrightページ。
+        resource_types (set): 遮断するリソースの種類（例: {"image", "media", "font"}）。
+    """
+    def _handle(route, request):
+        if request.resource_type in resource_types or any(k in request.url for k in BLOCKED_URL_KEYWORDS):
+            route.abort()
+        else:
+            route.continue_()
+
+    page.route("**/*", _handle)
+
+def wait_for_cdp_port(timeout: float, interval: float = 0.2) -> bool:
+    """
+    CDPのポートが接続を受け付けるようになるまで待機します。
+
+    Args:
+        timeout (float): 待機する最大秒数。
+        interval (float): 接続を確認する間隔（秒）。
+
+    Returns:
+        bool: 時間内にポートが開いた場合はTrue。
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection((CDP_HOST, CDP_PORT), timeout=0.5):
+                return True
+        except OSError:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+
+def connect_browser(playwright: Playwright, wait_timeout: float = 0) -> Browser:
+    """
+    デバッグモードで起動中のChromeにCDPで接続します。
+    Chromeの起動を待つ場合は、ポートが開くまでTCPで軽く確認してから一度だけ接続します。
+
+    Args:
+        playwright (Playwright): 起動済みのPlaywrightインスタンス。
+        wait_timeout (float): CDPのポートが開くまで待機する最大秒数。
+
+    Returns:
+        Browser: 接続したブラウザ。
+
+    Raises:
+        PlaywrightError: 接続に失敗した場合。
+    """
+    logging.info("デバッグモードで起動中のChrome (ポート9222) に接続します。")
+    if wait_timeout > 0 and not wait_for_cdp_port(wait_timeout):
+        logging.warning(f"{wait_timeout}秒待機してもChromeのポート{CDP_PORT}に接続できませんでした。")
+    browser = playwright.chromium.connect_over_cdp(CDP_URL)
+    logging.info("Chromeへの接続に成功しました。")
+    return browser
+
+def save_error_screenshot(page: Page, path: str) -> None:
+    """
+    エラー調査用に、表示中の画面のスクリーンショットをJPEGで保存します。
+    SCREENSHOT_ON_ERROR が無効な場合や、ページが既に閉じられている場合は何もしません。
+
+    Args:
+        page (Page): 対象のPlaywrightページ。Noneの場合は何もしません。
+        path (str): 保存先のファイルパス。
+    """
+    if not SCREENSHOT_ON_ERROR or page is None or page.is_closed():
+        return
+    try:
+        # ページ全体ではなく表示範囲のみを、PNGより軽量なJPEGで保存する
+        page.screenshot(path=path, type="jpeg", quality=60)
+        logging.info(f"エラー発生時のスクリーンショットを {path} に保存しました。")
+    except PlaywrightError as e:
+        logging.warning(f"スクリーンショットの保存に失敗しました: {e}")
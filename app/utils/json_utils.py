@@ -0,0 +1,46 @@
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dump_json_bytes(data) -> bytes:
+    """
+    データをUTF-8のJSONバイト列にシリアライズします。
+    orjsonがインストールされていれば使用し、なければ標準のjsonモジュールにフォールバックします。
+
+    Args:
+        data: シリアライズするデータ（JSONシリアライズ可能なオブジェクト）。
+
+    Returns:
+        bytes: JSONのバイト列。
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+
+def write_bytes_atomic(path: str, payload: bytes) -> None:
+    """
+    バイト列を一時ファイル経由でアトミックに保存します。
+
+    Args:
+        path (str): 保存先のファイルパス。
+        payload (bytes): 書き込むバイト列。
+    """
+    # 一時ファイルに一度で書き込んでから置き換えることで、書き込み途中のクラッシュでもファイルが壊れないようにする
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+def save_json_atomic(path: str, data) -> None:
+    """
+    データをJSONとしてシリアライズし、一時ファイル経由でアトミックに保存します。
+
+    Args:
+        path (str): 保存先のファイルパス。
+        data: 保存するデータ（JSONシリアライズ可能なオブジェクト）。
+    """
+    write_bytes_atomic(path, dump_json_bytes(data))
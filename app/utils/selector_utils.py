@@ -1,5 +1,10 @@
 import re
+import functools
 
+# `クラス名--ハッシュ値` 形式のクラス指定（例: .container--a3dH_）
+_HASH_RE = re.compile(r'\.([\w-]+--[\w\d_-]+)')
+
+@functools.lru_cache(maxsize=None)
 def convert_to_robust_selector(selector: str) -> str:
     """
     ハッシュ値を含む可能性のあるCSSセレクタを、より堅牢な形式に変換します。
@@ -20,8 +25,7 @@ def convert_to_robust_selector(selector: str) -> str:
 
     for part in parts:
         # 正規表現で `クラス名--ハッシュ値` のパターンを探す
-        # 例: .container--a3dH_
-        match = re.search(r'\.([\w-]+--[\w\d_-]+)', part)
+        match = _HASH_RE.search(part)
         if match:
             class_with_hash = match.group(1) # container--a3dH_
             class_base = class_with_hash.split('--')[0] + '--' # container--